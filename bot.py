@@ -1,12 +1,20 @@
 import os
+import importlib
 import logging
 import tempfile
+import contextlib
+from pathlib import Path
+import shutil
 import asyncio
 import re
 import time
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from datetime import timedelta
+from aiolimiter import AsyncLimiter
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import BadRequest, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import yt_dlp
+import httpx
 import sys
 
 # Enable logging
@@ -18,40 +26,81 @@ logger = logging.getLogger(__name__)
 # Bot token from environment variable
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
-# User data storage
-user_data = {}
-download_progress = {}
+# Public HTTPS URL for webhook mode, falls back to polling when unset
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+
+# YouTube URL pattern, compiled once for every incoming message
+YOUTUBE_RE = re.compile(r'^(?:https?://)?(?:www\.)?(?:youtube|youtu|youtube-nocookie)\.(?:com|be)/', re.ASCII)
+URL_PREFIXES = ('http://', 'https://', 'www.', 'youtu')
+
+# Local telegram-bot-api server, e.g. http://127.0.0.1:8081/bot
+LOCAL_BOT_API_URL = os.environ.get("LOCAL_BOT_API_URL")
+# Set when that server can read this process's temp dir (same host or shared volume),
+# uploads then pass the file path instead of the file contents
+LOCAL_BOT_API_SHARED_FS = os.environ.get("LOCAL_BOT_API_SHARED_FS") == "1"
+
+# Largest file Telegram accepts, yt-dlp skips anything bigger
+MAX_UPLOAD_SIZE = (2000 if LOCAL_BOT_API_URL else 50) * 1024 * 1024
+
+# tmpfs space reserved per download, MP4 merges hold both streams plus the output
+SHM_DIR = '/dev/shm'
+SHM_RESERVATION = 2 * MAX_UPLOAD_SIZE
+shm_reserved = 0
+
+# Format keyboards per chat whose URL is remembered
+MAX_PENDING_URLS = 10
+
+# Minimum seconds between progress edits of the same chat
+PROGRESS_EDIT_INTERVAL = 4.0
+
+# Bound parallel yt-dlp/FFmpeg jobs to the available CPUs
+DOWNLOAD_SEM = asyncio.Semaphore(max(2, os.cpu_count() or 4))
+download_waiters = []
+
+# Progress snapshots posted from yt-dlp threads, drained by progress_consumer
+progress_queue = None
+progress_task = None
+prewarm_task = None
+event_loop = None
+
+# Cleared while Telegram flood control is in effect, see tg_call
+api_ready = asyncio.Event()
+api_ready.set()
+
+# Global cap on progress edits, below Telegram's 30 msg/s bot-wide limit
+edit_limiter = AsyncLimiter(25, 1)
 
 # Define yt-dlp options with progress hook
 def get_ydl_opts(format_type, output_path, chat_id):
     def progress_hook(d):
         if d['status'] == 'downloading':
-            percent = d.get('_percent_str', '0%')
-            speed = d.get('_speed_str', 'N/A')
-            eta = d.get('_eta_str', 'N/A')
-            
-            download_progress[chat_id] = {
+            snapshot = {
                 'status': 'downloading',
-                'percent': percent,
-                'speed': speed,
-                'eta': eta,
-                'last_update': time.time()
+                'percent': d.get('_percent_str', '0%'),
+                'speed': d.get('_speed_str', 'N/A'),
+                'eta': d.get('_eta_str', 'N/A'),
             }
         elif d['status'] == 'finished':
-            download_progress[chat_id] = {
+            snapshot = {
                 'status': 'finished',
                 'percent': '100%',
                 'speed': 'N/A',
                 'eta': '0s',
-                'last_update': time.time()
             }
+        else:
+            return
+        
+        # yt-dlp runs in a worker thread, hand the snapshot over to the event loop
+        event_loop.call_soon_threadsafe(progress_queue.put_nowait, (chat_id, snapshot))
     
     common_opts = {
         'outtmpl': output_path,
         'quiet': True,
         'no_warnings': False,
         'progress_hooks': [progress_hook],
-        'n_threads': 8,
+        'concurrent_fragment_downloads': 8, # Parallel DASH/HLS fragment downloads
+        'http_chunk_size': 10485760, # 10 MiB ranged requests for progressive streams
+        'max_filesize': MAX_UPLOAD_SIZE,
         'retries': 5,
         'fragment_retries': 5,
         'cookiefile': './cookies.txt', # Use cookie file for authentication
@@ -64,65 +113,130 @@ def get_ydl_opts(format_type, output_path, chat_id):
             'postprocessors': [{
                 'key': 'FFmpegExtractAudio',
                 'preferredcodec': 'mp3',
-                'preferredquality': '320',
+                'preferredquality': '0', # LAME VBR best quality
             }],
+            'postprocessor_args': {
+                'extractaudio+ffmpeg_o': ['-threads', '0'],
+            },
+            'prefer_ffmpeg': True,
             'extract_audio': True,
             'audio_format': 'mp3',
             'audio_quality': '0',
         }
+    elif format_type == 'm4a':
+        # YouTube serves AAC in m4a natively, so extraction is a stream copy
+        return {
+            **common_opts,
+            'format': 'bestaudio[ext=m4a]/bestaudio',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'm4a',
+            }],
+            'prefer_ffmpeg': True,
+        }
     else:  # mp4
         return {
             **common_opts,
             'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'merge_output_format': 'mp4',
-            'recode_video': 'mp4',
+            'merge_output_format': 'mp4', # Stream-copy mux, no re-encode
+            'remux_video': 'mp4', # The /best fallback may be webm/mkv, remux without re-encoding
             'prefer_ffmpeg': True,
             'ffmpeg_location': 'ffmpeg', # Default path for Render
         }
 
+async def tg_call(call_factory, retries=5, idempotent=True):
+    """Run a Bot API call, waiting out flood control and timeouts.
+
+    A RetryAfter pauses every tg_call until Telegram's back-off has passed.
+    Calls that send or delete something pass idempotent=False, they are only
+    retried on timeouts raised before the request reached Telegram. On a
+    retry, "not modified"/"not found" means the earlier attempt got through.
+    """
+    for attempt in range(retries):
+        await api_ready.wait()
+        try:
+            return await call_factory()
+        except BadRequest as e:
+            message = str(e).lower()
+            if attempt > 0 and ('not modified' in message or 'not found' in message):
+                return None
+            raise
+        except RetryAfter as e:
+            if attempt == retries - 1:
+                raise
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Flood control, retrying in {retry_after}s")
+            # Only the first caller sleeps, the rest wait on the event
+            if api_ready.is_set():
+                api_ready.clear()
+                try:
+                    await asyncio.sleep(retry_after + 0.5)
+                finally:
+                    api_ready.set()
+        except TimedOut as e:
+            # A read timeout on a send usually means Telegram accepted it already
+            unsent = isinstance(e.__cause__, (httpx.ConnectTimeout, httpx.PoolTimeout))
+            if attempt == retries - 1 or not (idempotent or unsent):
+                raise
+            await asyncio.sleep(1)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
-    await update.message.reply_text(
+    await tg_call(lambda: update.message.reply_text(
         "🚀 *Welcome to Ultra-Fast YouTube Downloader Bot!*\n\n"
         "Send me a YouTube link and I'll download it for you at maximum speed!",
         parse_mode='Markdown'
-    )
+    ), idempotent=False)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /help is issued."""
-    await update.message.reply_text(
+    await tg_call(lambda: update.message.reply_text(
         "✨ *How to use:*\n"
         "1. Send me a YouTube URL\n"
-        "2. Choose your preferred format (MP4/MP3)\n"
+        "2. Choose your preferred format (MP4/MP3/M4A)\n"
         "3. Watch real-time progress\n"
         "4. Receive your downloaded media!\n\n"
         "✅ All videos are supported.",
         parse_mode='Markdown'
-    )
+    ), idempotent=False)
+
+# Precomputed bars for each of the 11 fill levels
+PROGRESS_BARS = tuple("🟦" * i + "⬜" * (10 - i) for i in range(11))
 
 def create_progress_bar(percentage_str):
     """Create a visual progress bar."""
     try:
-        percent_value = float(percentage_str.strip('%').split('.')[0])
-    except (ValueError, IndexError):
+        percent_value = int(float(percentage_str.strip().strip('%')))
+    except ValueError:
         percent_value = 0
-        
-    bars = 10
-    filled_bars = int(percent_value / 10)
-    empty_bars = bars - filled_bars
     
-    progress_bar = "🟦" * filled_bars + "⬜" * empty_bars
+    progress_bar = PROGRESS_BARS[min(10, max(0, percent_value // 10))]
     return f"`{progress_bar}` {percentage_str}"
 
-async def progress_updater(context: ContextTypes.DEFAULT_TYPE):
-    """Update progress messages for all active downloads."""
-    for chat_id, progress_data in list(download_progress.items()):
+async def progress_consumer(application: Application):
+    """Edit progress messages from queued snapshots, throttled per chat."""
+    while True:
+        chat_id, progress_data = await progress_queue.get()
         try:
-            if time.time() - progress_data.get('last_update', 0) > 300:
-                del download_progress[chat_id]
+            chat_data = application.chat_data.get(chat_id, {})
+            # Per-download state, download_media starts each download with a fresh dict
+            progress_state = chat_data.get('progress')
+            # Download already moved on to the upload stage
+            if progress_state is None:
+                continue
+            
+            now = time.monotonic()
+            if (progress_data['status'] == 'downloading'
+                    and now - progress_state.get('last_edit_ts', 0) < PROGRESS_EDIT_INTERVAL):
                 continue
             
-            if progress_data['status'] == 'downloading':
+            if progress_data['status'] == 'queued':
+                status_text = f"⏳ *Queued, position {progress_data['position']}...*"
+            elif progress_data['status'] == 'starting':
+                status_text = "📥 *Starting Download...*"
+            elif progress_data['status'] == 'downloading':
                 progress_bar = create_progress_bar(progress_data['percent'])
                 status_text = (
                     f"📥 *Downloading...*\n\n"
@@ -131,178 +245,276 @@ async def progress_updater(context: ContextTypes.DEFAULT_TYPE):
                     f"**ETA:** {progress_data['eta']}\n\n"
                     f"`Please wait, processing at maximum speed...`"
                 )
+            else:
+                status_text = (
+                    f"⚙️ *Processing...*\n\n"
+                    f"{create_progress_bar(progress_data['percent'])}"
+                )
+            
+            # Merged MP4s finish twice, editing to the same text is a BadRequest
+            if status_text == progress_state.get('last_text'):
+                continue
+            
+            async with edit_limiter:
+                if chat_data.get('progress') is not progress_state:
+                    continue
+                progress_state['status'] = progress_data['status']
+                progress_state['last_edit_ts'] = time.monotonic()
+                progress_state['last_text'] = status_text
                 
-                if chat_id in user_data and 'progress_message_id' in user_data[chat_id]:
-                    await context.bot.edit_message_text(
+                async def edit_progress():
+                    # A flood-control retry may come after the download moved on
+                    if chat_data.get('progress') is not progress_state:
+                        return None
+                    return await application.bot.edit_message_text(
                         chat_id=chat_id,
-                        message_id=user_data[chat_id]['progress_message_id'],
+                        message_id=chat_data['progress_message_id'],
                         text=status_text,
                         parse_mode='Markdown'
                     )
+                
+                await tg_call(edit_progress)
             
         except Exception as e:
             logger.error(f"Progress update error: {e}")
 
+async def post_init(application: Application):
+    """Start the progress consumer once the event loop is running."""
+    global event_loop, progress_queue, progress_task, prewarm_task
+    event_loop = asyncio.get_running_loop()
+    progress_queue = asyncio.Queue()
+    # The application isn't running yet, so it wouldn't track tasks created here
+    progress_task = asyncio.create_task(progress_consumer(application))
+    # Pre-warm yt-dlp's heavy import in the background to keep cold starts fast
+    prewarm_task = asyncio.create_task(asyncio.to_thread(importlib.import_module, 'yt_dlp'))
+
+async def post_shutdown(application: Application):
+    """Stop the progress consumer."""
+    # The import thread can't be interrupted, let it finish
+    if prewarm_task:
+        await asyncio.gather(prewarm_task, return_exceptions=True)
+    if progress_task:
+        progress_task.cancel()
+        try:
+            await progress_task
+        except asyncio.CancelledError:
+            pass
+
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the YouTube URL sent by user."""
     url = update.message.text.strip()
-    chat_id = update.message.chat_id
     
-    youtube_regex = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/.+'
-    if not re.match(youtube_regex, url):
-        await update.message.reply_text(
+    # Cheap prefix check rejects ordinary chatter before running the regex
+    if not url.startswith(URL_PREFIXES) or not YOUTUBE_RE.match(url):
+        await tg_call(lambda: update.message.reply_text(
             "❌ *Invalid YouTube URL!*\nPlease send a valid YouTube link.",
             parse_mode='Markdown'
-        )
+        ), idempotent=False)
         return
     
-    # Store user data
-    user_data[chat_id] = {
-        'url': url,
-        'user_id': update.message.from_user.id,
-        'chat_id': chat_id
-    }
+    context.chat_data['user_id'] = update.message.from_user.id
     
     # Ask for format choice
     keyboard = [
         [InlineKeyboardButton("🎥 MP4 Video", callback_data='format_mp4')],
-        [InlineKeyboardButton("🎵 MP3 Audio", callback_data='format_mp3')]
+        [InlineKeyboardButton("🎵 MP3 Audio", callback_data='format_mp3')],
+        [InlineKeyboardButton("🎧 M4A Audio (fast)", callback_data='format_m4a')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    message = await update.message.reply_text(
+    message = await tg_call(lambda: update.message.reply_text(
         "🌌 *URL received!* Choose your desired format:",
         reply_markup=reply_markup,
         parse_mode='Markdown'
-    )
+    ), idempotent=False)
     
-    user_data[chat_id]['format_message_id'] = message.message_id
+    context.chat_data['format_message_id'] = message.message_id
+    
+    # Remember which URL this keyboard belongs to, a later URL must not replace it
+    pending_urls = context.chat_data.setdefault('pending_urls', {})
+    pending_urls[message.message_id] = url
+    while len(pending_urls) > MAX_PENDING_URLS:
+        del pending_urls[next(iter(pending_urls))]
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline button presses."""
     query = update.callback_query
-    await query.answer()
+    await tg_call(query.answer)
     
     chat_id = query.message.chat_id
     data = query.data
     
     if data.startswith('format_'):
-        if chat_id not in user_data:
-            await query.edit_message_text("❌ Session expired. Please send the URL again.")
-            return
-            
-        format_type = data.split('_')[1]
-        user_data[chat_id]['format'] = format_type
-        
-        progress_message = await query.message.reply_text(
-            "⚡ *Initializing ultra-fast download...*\n\n"
-            "🚀 Preparing multi-threaded download...",
-            parse_mode='Markdown'
-        )
-        
-        user_data[chat_id]['progress_message_id'] = progress_message.message_id
+        # Read the URL of the pressed keyboard now, newer URLs may arrive while waiting
+        url = context.chat_data.get('pending_urls', {}).get(query.message.message_id)
         
-        await download_media(context, chat_id)
+        # One download at a time per chat, different chats run in parallel
+        async with context.chat_data.setdefault('lock', asyncio.Lock()):
+            if url is None:
+                await tg_call(lambda: query.edit_message_text("❌ Session expired. Please send the URL again."))
+                return
+                
+            format_type = data.split('_')[1]
+            context.chat_data['url'] = url
+            context.chat_data['format'] = format_type
+            
+            progress_message = await tg_call(lambda: query.message.reply_text(
+                "⚡ *Initializing ultra-fast download...*\n\n"
+                "🚀 Preparing multi-threaded download...",
+                parse_mode='Markdown'
+            ), idempotent=False)
+            
+            context.chat_data['progress_message_id'] = progress_message.message_id
+            
+            await download_media(context, chat_id)
+
+def shm_free_bytes():
+    """Return the free space on tmpfs, or 0 if it can't be used."""
+    if not (os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)):
+        return 0
+    return shutil.disk_usage(SHM_DIR).free
+
+def find_downloaded_file(tmp_dir):
+    """Return the path and size of the downloaded media file in tmp_dir."""
+    with os.scandir(tmp_dir) as it:
+        for entry in it:
+            if entry.name.endswith(('.mp4', '.mp3', '.m4a')) and entry.is_file():
+                size = entry.stat().st_size
+                if size > 0:
+                    return entry.path, size
+    return None, 0
+
+def open_input_file(path):
+    """Read a local file into an InputFile, meant to run off the event loop."""
+    with open(path, 'rb') as f:
+        return InputFile(f, filename=os.path.basename(path))
 
 async def download_media(context, chat_id):
     """Download the media with real progress tracking."""
+    global shm_reserved
+    chat_data = context.chat_data
     try:
-        if chat_id not in user_data:
+        if 'url' not in chat_data:
             return
             
-        url = user_data[chat_id]['url']
-        format_type = user_data[chat_id]['format']
-        progress_message_id = user_data[chat_id]['progress_message_id']
+        url = chat_data['url']
+        format_type = chat_data['format']
+        progress_message_id = chat_data['progress_message_id']
         
-        download_progress[chat_id] = {
-            'status': 'starting',
-            'percent': '0%',
-            'speed': 'N/A',
-            'eta': 'N/A',
-            'last_update': time.time()
-        }
+        chat_data['progress'] = {'status': 'pending'}
         
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            output_template = os.path.join(tmp_dir, '%(title).100s.%(ext)s')
-            
+        # The temp dir is created once a download slot is free and lives until the upload is done
+        with contextlib.ExitStack() as stack:
             def blocking_download():
+                import yt_dlp  # Imported lazily, see post_init
                 ydl_opts = get_ydl_opts(format_type, output_template, chat_id)
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    title = info.get('title', 'download')
-                    user_data[chat_id]['title'] = title
-                    download_progress[chat_id]['status'] = 'downloading'
-                    ydl.download([url])
-                    return info
+                    # Extract and download in one pass, ydl.download() would re-extract
+                    return ydl.extract_info(url, download=True)
             
             try:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=progress_message_id,
-                    text="📥 *Starting Download...*",
-                    parse_mode='Markdown'
-                )
-                info = await asyncio.to_thread(blocking_download)
-                title = user_data[chat_id]['title']
+                # Queue and start messages go through progress_consumer to keep them in order
+                download_waiters.append(chat_id)
+                try:
+                    if DOWNLOAD_SEM.locked():
+                        progress_queue.put_nowait((chat_id, {
+                            'status': 'queued',
+                            'position': len(download_waiters),
+                        }))
+                    await DOWNLOAD_SEM.acquire()
+                finally:
+                    download_waiters.remove(chat_id)
+                    # Everyone behind this chat moved up one place
+                    for position, waiting_chat_id in enumerate(download_waiters, 1):
+                        progress_queue.put_nowait((waiting_chat_id, {
+                            'status': 'queued',
+                            'position': position,
+                        }))
+                
+                shm_reservation = 0
+                try:
+                    # Use tmpfs only if it has room for this download on top of those running,
+                    # a local API server reading our files can't see this container's tmpfs
+                    tmp_root = None
+                    if (not LOCAL_BOT_API_SHARED_FS
+                            and await asyncio.to_thread(shm_free_bytes) - shm_reserved >= SHM_RESERVATION):
+                        tmp_root = SHM_DIR
+                        shm_reservation = SHM_RESERVATION
+                        shm_reserved += shm_reservation
+                    
+                    tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(dir=tmp_root))
+                    output_template = os.path.join(tmp_dir, '%(title).100s.%(ext)s')
+                    
+                    progress_queue.put_nowait((chat_id, {'status': 'starting'}))
+                    info = await asyncio.to_thread(blocking_download)
+                finally:
+                    shm_reserved -= shm_reservation
+                    DOWNLOAD_SEM.release()
+                title = info.get('title', 'download')
             except Exception as e:
                 raise Exception(f"Download process failed: {e}")
+            finally:
+                # Stop queued progress edits from racing with the upload stage
+                chat_data.pop('progress', None)
             
-            downloaded_file = None
-            for file in os.listdir(tmp_dir):
-                if file.endswith(('.mp4', '.mp3')):
-                    downloaded_file = os.path.join(tmp_dir, file)
-                    break
+            downloaded_file, file_size = await asyncio.to_thread(find_downloaded_file, tmp_dir)
             
-            if not downloaded_file or os.path.getsize(downloaded_file) == 0:
+            if not downloaded_file and (info.get('filesize') or info.get('filesize_approx') or 0) > MAX_UPLOAD_SIZE:
+                raise Exception(f"File too large for Telegram ({MAX_UPLOAD_SIZE // (1024*1024)}MB limit).")
+            if not downloaded_file or file_size == 0:
                 raise Exception("Downloaded file not found or is empty.")
             
             # --- UPLOAD STAGE ---
-            await context.bot.edit_message_text(
+            await tg_call(lambda: context.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=progress_message_id,
                 text="📤 *Uploading to Telegram...*\n\n"
                      "✅ Download completed successfully!",
                 parse_mode='Markdown'
-            )
+            ))
             
-            file_size = os.path.getsize(downloaded_file)
             caption = f"🎥 {title}" if format_type == 'mp4' else f"🎵 {title}"
             
             try:
-                if format_type == 'mp3':
-                    await context.bot.send_audio(
+                if file_size > MAX_UPLOAD_SIZE:
+                    raise Exception(f"File too large for Telegram ({MAX_UPLOAD_SIZE // (1024*1024)}MB limit).")
+                
+                if LOCAL_BOT_API_URL and LOCAL_BOT_API_SHARED_FS:
+                    # Local mode hands the server the path, no multipart upload
+                    input_file = Path(downloaded_file)
+                else:
+                    input_file = await asyncio.to_thread(open_input_file, downloaded_file)
+                if format_type in ('mp3', 'm4a'):
+                    await tg_call(lambda: context.bot.send_audio(
                         chat_id=chat_id,
-                        audio=open(downloaded_file, 'rb'),
+                        audio=input_file,
                         caption=caption,
                         parse_mode='Markdown',
                         title=title[:64],
                         performer="YouTube"
-                    )
+                    ), idempotent=False)
                 else:
-                    if file_size > 2000 * 1024 * 1024:
-                        raise Exception("File too large for Telegram (2GB limit).")
-                        
-                    await context.bot.send_video(
+                    await tg_call(lambda: context.bot.send_video(
                         chat_id=chat_id,
-                        video=open(downloaded_file, 'rb'),
+                        video=input_file,
                         caption=caption,
                         supports_streaming=True,
                         parse_mode='Markdown',
                         width=info.get('width', 1280),
                         height=info.get('height', 720),
                         duration=info.get('duration', 0)
-                    )
+                    ), idempotent=False)
             except Exception as e:
                 raise Exception(f"Upload to Telegram failed: {e}")
             
-            await context.bot.delete_message(chat_id=chat_id, message_id=progress_message_id)
+            await tg_call(lambda: context.bot.delete_message(chat_id=chat_id, message_id=progress_message_id), idempotent=False)
             
             keyboard = [
                 [InlineKeyboardButton("🔄 Download Another", callback_data='another_download')]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await context.bot.send_message(
+            await tg_call(lambda: context.bot.send_message(
                 chat_id=chat_id,
                 text=f"✅ *Download Complete!*\n\n"
                      f"**Title:** {title}\n"
@@ -310,7 +522,7 @@ async def download_media(context, chat_id):
                      f"**Size:** {file_size // (1024*1024)}MB",
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
-            )
+            ), idempotent=False)
                 
     except Exception as e:
         logger.error(f"Download/Upload error: {e}")
@@ -322,31 +534,30 @@ async def download_media(context, chat_id):
         )
         
         try:
-            await context.bot.edit_message_text(
+            await tg_call(lambda: context.bot.edit_message_text(
                 chat_id=chat_id,
-                message_id=user_data[chat_id]['progress_message_id'],
+                message_id=chat_data['progress_message_id'],
                 text=error_msg,
                 parse_mode='Markdown'
-            )
+            ))
         except:
-            await context.bot.send_message(
+            await tg_call(lambda: context.bot.send_message(
                 chat_id=chat_id,
                 text=error_msg,
                 parse_mode='Markdown'
-            )
+            ), idempotent=False)
     finally:
-        if chat_id in download_progress:
-            del download_progress[chat_id]
+        chat_data.pop('progress', None)
 
 async def another_download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the 'download another' button press."""
     query = update.callback_query
-    await query.answer()
+    await tg_call(query.answer)
     
-    await query.edit_message_text(
+    await tg_call(lambda: query.edit_message_text(
         text="✨ *Send me another YouTube URL*",
         parse_mode='Markdown'
-    )
+    ))
 
 def main():
     """Start the bot."""
@@ -354,7 +565,29 @@ def main():
         logger.error("BOT_TOKEN environment variable not set. Please set it to your bot's token.")
         sys.exit(1)
         
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Pooled HTTP/2 connections so API calls for different chats overlap,
+    # a self-hosted Bot API server only speaks HTTP/1.1
+    http_version = '1.1' if LOCAL_BOT_API_URL else '2'
+    request = HTTPXRequest(
+        connection_pool_size=256,
+        pool_timeout=20,
+        read_timeout=60,
+        media_write_timeout=600, # Applies to requests carrying files, i.e. uploads
+        http_version=http_version,
+    )
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(HTTPXRequest(connection_pool_size=16, http_version=http_version))
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if LOCAL_BOT_API_URL:
+        base_file_url = LOCAL_BOT_API_URL.removesuffix('/bot') + '/file/bot'
+        builder = builder.base_url(LOCAL_BOT_API_URL).base_file_url(base_file_url).local_mode(True)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -362,11 +595,17 @@ def main():
     application.add_handler(CallbackQueryHandler(button_handler, pattern='^format_'))
     application.add_handler(CallbackQueryHandler(another_download_handler, pattern='^another_download'))
 
-    job_queue = application.job_queue
-    job_queue.run_repeating(progress_updater, interval=3, first=5)
-
     logger.info("Bot starting...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=int(os.environ.get("PORT", 8443)),
+            webhook_url=WEBHOOK_URL,
+            secret_token=os.environ.get("WEBHOOK_SECRET"),
+            drop_pending_updates=True,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()